@@ -1,20 +1,165 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
-from __future__ import print_function
 import argparse
-import glob
+import mmap
 import os
 import re
 import stat
+import struct
 import sys
+from concurrent.futures import ThreadPoolExecutor
 import PIL
-from PIL.ExifTags import TAGS
 from PIL import Image
 
 
-# Need to look for *.JPG, *.jpg, and *.jpeg files for consideration.
-EXTENSIONS = ['JPG', 'jpg', 'jpeg']
+# Need to look for *.JPG, *.jpg, and *.jpeg files for consideration. Matched
+# against the lowercased file extension.
+EXTENSIONS = ('jpg', 'jpeg')
 MAX_RENAME_ATTEMPTS = 10
+# Fewer files than this are renamed one at a time even if --jobs is given.
+MIN_CONCURRENT_RENAMES = 8
+
+# YYYYMMDD_HHMMSS.jpg with an optional -N collision suffix.
+_NUMBERED_FN_RE = re.compile(r'^(\d+_\d+)(?:-\d+)?\.jpg')
+
+# JPEG markers and EXIF tags needed to find DateTimeOriginal without PIL.
+_JPEG_SOI = b'\xff\xd8'
+_JPEG_APP1 = 0xE1
+_JPEG_SOS = 0xDA
+_EXIF_HEADER = b'Exif\x00\x00'
+_EXIF_IFD_POINTER = 0x8769
+_DATE_TIME_ORIGINAL = 0x9003
+
+# Drop colons and replace spaces with underscores in new filenames.
+_FN_TRANS = str.maketrans({':': '', ' ': '_'})
+
+
+def _is_jpeg_name(name):
+    """Return True if name has one of the EXTENSIONS, in any case. Like glob,
+    skip dotfiles such as macOS ._IMG_0001.JPG files, and names that are
+    only an extension.
+
+    >>> _is_jpeg_name('IMG_0001.JPG')
+    True
+    >>> _is_jpeg_name('._IMG_0001.JPG')
+    False
+    >>> _is_jpeg_name('jpg')
+    False
+    """
+    base, dot, extension = name.rpartition('.')
+    return (bool(dot) and bool(base) and not name.startswith('.') and
+            extension.lower() in EXTENSIONS)
+
+
+def _is_exif_dt(value):
+    """Return True if value is an EXIF date in the YYYY:MM:DD HH:MM:SS form.
+
+    >>> _is_exif_dt('2014:08:16 06:20:30')
+    True
+    >>> _is_exif_dt('2014-08-18 20:23:83')
+    False
+    """
+    return (len(value) == 19 and
+            value[4] == ':' and value[7] == ':' and value[10] == ' ' and
+            value[13] == ':' and value[16] == ':' and
+            (value[:4] + value[5:7] + value[8:10] + value[11:13] +
+             value[14:16] + value[17:]).isdigit() and value.isascii())
+
+
+def _exif_dt_to_fn(exif_dt):
+    """Build YYYYMMDD_HHMMSS.jpg from an EXIF date already checked by
+    _is_exif_dt(). The layout is fixed, so the digits are sliced out directly.
+
+    >>> _exif_dt_to_fn('2014:08:16 06:20:30')
+    '20140816_062030.jpg'
+    """
+    d = exif_dt
+    return f"{d[:4]}{d[5:7]}{d[8:10]}_{d[11:13]}{d[14:16]}{d[17:]}.jpg"
+
+
+def _old_fn_to_fn(old_fn):
+    """Lowercase filename base and extension and normalize .jpeg to .jpg.
+
+    XXX: The intention here is to clean up just a bit even if we're not really
+    renaming the file. Windows doesn't like colons in filenames.
+
+    >>> _old_fn_to_fn('IMG 01:02.JPEG')
+    'img_0102.jpg'
+    """
+    lower = old_fn.lower()
+    if lower.endswith('.jpeg'):
+        lower = lower[:-5] + '.jpg'
+    return lower.translate(_FN_TRANS)
+
+
+def _find_ifd_entry(tiff, byte_order, offset, tag):
+    """Return (type, count, value) for tag in the TIFF IFD at offset, or None
+    if the IFD does not contain tag."""
+    count, = struct.unpack_from(byte_order + 'H', tiff, offset)
+    for entry in range(offset + 2, offset + 2 + count * 12, 12):
+        entry_tag, entry_type, entry_count, value = struct.unpack_from(
+                byte_order + 'HHII', tiff, entry)
+        if entry_tag == tag:
+            return entry_type, entry_count, value
+    return None
+
+
+def _read_exif_datetime(path):
+    """Read DateTimeOriginal straight from the APP1 segment of a JPEG file.
+
+    The file is memory mapped and only the APP1 segment is copied out of it.
+    Only IFD0 and the EXIF IFD are walked. Returns None if the value cannot
+    be found this way.
+    """
+    try:
+        tiff = None
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0,
+                access=mmap.ACCESS_READ) as data:
+            if data[:2] != _JPEG_SOI:
+                return None
+
+            # Walk the marker segments up to the start of the image data.
+            # Stop at a truncated marker and segment length header.
+            index = 2
+            while index + 4 <= len(data) and data[index] == 0xFF:
+                marker = data[index + 1]
+                length, = struct.unpack_from('>H', data, index + 2)
+                if marker == _JPEG_SOS:
+                    break
+                start = index + 4 + len(_EXIF_HEADER)
+                if (marker == _JPEG_APP1 and
+                        data[index + 4:start] == _EXIF_HEADER):
+                    tiff = data[start:index + 2 + length]
+                    break
+                index += 2 + length
+        if tiff is None:
+            return None
+
+        byte_order = {b'II': '<', b'MM': '>'}.get(tiff[:2])
+        if byte_order is None:
+            return None
+        ifd0, = struct.unpack_from(byte_order + 'I', tiff, 4)
+        entry = _find_ifd_entry(tiff, byte_order, ifd0, _EXIF_IFD_POINTER)
+        if entry is None:
+            return None
+        entry = _find_ifd_entry(tiff, byte_order, entry[2],
+                _DATE_TIME_ORIGINAL)
+        if entry is None:
+            return None
+
+        # ASCII values of up to four bytes are stored in the entry itself.
+        entry_type, count, value = entry
+        if entry_type != 2:
+            return None
+        if count <= 4:
+            raw = struct.pack(byte_order + 'I', value)[:count]
+        else:
+            raw = tiff[value:value + count]
+        return raw.rstrip(b'\x00').decode('ascii')
+    except (OSError, ValueError, struct.error):
+        # ValueError covers empty files, which cannot be mapped, and
+        # UnicodeDecodeError.
+        return None
 
 
 class FileMap():
@@ -24,9 +169,13 @@ class FileMap():
     Arguments:
         str: old_fn - Old Filename
         dict: exif_data - For testing only. Dict with sample EXIF data.
+        set: existing_fns - Case-folded filenames present in workdir, as
+            returned by list_existing_fns(). Shared between instances and
+            kept current by move(). Listed on demand if None.
     """
 
-    def __init__(self, old_fn, avoid_collisions=None, exif_data=None):
+    def __init__(self, old_fn, avoid_collisions=None, exif_data=None,
+            existing_fns=None):
         """Initialize FileMap instance.
 
         >>> filemap = FileMap('abc123.jpeg', None, {})
@@ -38,8 +187,10 @@ class FileMap():
         """
         self.MAX_RENAME_ATTEMPTS = MAX_RENAME_ATTEMPTS
         self.old_fn_fq = old_fn
-        self.workdir = os.path.dirname(old_fn)
-        self.old_fn = os.path.basename(old_fn)
+        self.workdir, self.old_fn = os.path.split(old_fn)
+        # Prefix for fully qualified names in workdir. Empty if workdir is.
+        self.workdir_prefix = os.path.join(self.workdir, '')
+        self.existing_fns = existing_fns
 
         # Avoid filename collisions (dangerous) or log a message if there
         # would be one, and fail the move.
@@ -49,35 +200,36 @@ class FileMap():
         else:
             self.avoid_collisions = avoid_collisions
 
-        # Read EXIF data from old filename
+        # Read EXIF DateTimeOriginal from old filename
         if exif_data is None:
-            self.read_exif_data()
+            self.exif_dt = self.read_exif_data()
         else:
-            self.exif_data = exif_data
+            self.exif_dt = exif_data.get('DateTimeOriginal')
 
         self.get_new_fn()
 
     def read_exif_data(self):
-        """Read EXIF data from file. Convert to Python dict."""
+        """Read EXIF DateTimeOriginal from file. Returns None if the tag is
+        missing.
+
+        Look for it in the APP1 segment first. Fall back to PIL when that does
+        not work out.
+        """
+        exif_dt = _read_exif_datetime(self.old_fn_fq)
+        if exif_dt is not None:
+            return exif_dt
 
         # XXX: We already know file exists 'cuz we found it.
         img = Image.open(self.old_fn_fq)
         info = img._getexif()
 
-        self.exif_data ={}
-        if info is not None:
-            for tag, value in info.items():
-                decoded = TAGS.get(tag, tag)
-                self.exif_data[decoded] = value
-        else:
-            raise Exception("{0} has no EXIF data.".format(self.old_fn))
+        if info is None:
+            raise Exception(f"{self.old_fn} has no EXIF data.")
+        return info.get(_DATE_TIME_ORIGINAL)
 
     def get_new_fn(self):
-        """Generate new filename from old_fn EXIF data if possible. Even if not
-        possible, lowercase old_fn and normalize file extension.
-
-        Arguments:
-            dict: EXIF data
+        """Generate new filename from EXIF DateTimeOriginal if possible. Even
+        if not possible, lowercase old_fn and normalize file extension.
 
         >>> filemap = FileMap('abc123.jpeg', avoid_collisions=None, exif_data={'DateTimeOriginal': '2014:08:16 06:20:30'})
         >>> filemap.new_fn
@@ -85,46 +237,23 @@ class FileMap():
 
         """
 
-        # Start with EXIF DateTimeOriginal
-        try:
-            new_fn = self.exif_data['DateTimeOriginal']
-        except KeyError:
-            new_fn = None
-
-        # If this pattern does not strictly match then keep original name.
-        # YYYY:MM:DD HH:MM:SS
-        if (new_fn and not
-                re.match(r'^\d{4}:\d\d:\d\d \d\d:\d\d:\d\d$', new_fn)):
-            # Setup for next step.
-            new_fn = None
-
-        # Don't assume exif tag exists. If it does not, keep original filename.
-        # Lowercase filename base and extension
-        if new_fn is None:
-            new_fn = self.old_fn.lower()
-            new_fn = re.sub(r'.jpeg$', r'.jpg', new_fn)
+        # Rename using EXIF DateTimeOriginal only if it strictly matches
+        # YYYY:MM:DD HH:MM:SS. Don't assume exif tag exists. If it does not,
+        # keep original filename.
+        if self.exif_dt and _is_exif_dt(self.exif_dt):
+            new_fn = _exif_dt_to_fn(self.exif_dt)
         else:
-            new_fn = "{0}.jpg".format(new_fn)
-
-        # XXX: One may argue that the next step should be an 'else' clause of the
-        # previous 'if' statement. But the intention here is to clean up just a bit
-        # even if we're not really renaming the file. Windows doesn't like colons
-        # in filenames.
-
-        # Rename using exif DateTimeOriginal
-        new_fn = re.sub(r':', r'', new_fn)
-        new_fn = re.sub(r' ', r'_', new_fn)
+            new_fn = _old_fn_to_fn(self.old_fn)
 
         self.new_fn = new_fn
-        self.new_fn_fq = os.path.join(self.workdir, new_fn)
+        self.new_fn_fq = self.workdir_prefix + new_fn
 
     def _chmod(self):
         """Removes execute bit from file permission for USR, GRP, and OTH."""
         X_ANY = (stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
         st = os.stat(self.new_fn_fq)
         if bool(st.st_mode & X_ANY):
-            print( "Changing file mode to -rw-r--r-- on {0}.".format(
-                self.new_fn))
+            print(f"Changing file mode to -rw-r--r-- on {self.new_fn}.")
             os.chmod(self.new_fn_fq, st.st_mode ^ X_ANY)
 
     def move(self):
@@ -134,57 +263,87 @@ class FileMap():
         # initialization is performed before any files are moved. The file move
         # will change state and may introduce a collision. Doing the uniqueness
         # check here will check current state.
+        if self.reserve():
+            self.rename()
+
+    def reserve(self):
+        """Make new_fn unique and claim it in the directory listing so that no
+        other FileMap picks it. Returns False if the move must be aborted.
+        """
         try:
             self.make_new_fn_unique()
         except Exception as e:
             raise e
 
         if self.collision_detected:
-            print( "{0} => {1} Destination collision. Aborting.".format(
-                self.old_fn, self.new_fn))
+            print(f"{self.old_fn} => {self.new_fn} Destination collision. "
+                    "Aborting.")
                 #os.path.basename(self.old_fn), os.path.basename(self.new_fn)))
-            return
+            return False
+
+        if self.existing_fns is not None:
+            self.existing_fns.add(self.new_fn.casefold())
+        return True
 
+    def rename(self):
+        """Rename old_fn to the new_fn claimed by reserve()."""
         try:
-            print( "Moving the files: {0} ==> {1}".format(
-                self.old_fn, self.new_fn))
+            print(f"Moving the files: {self.old_fn} ==> {self.new_fn}")
             # XXX: Unit tests did not catch this bug.
             # os.rename(self.old_fn, self.new_fn)
             os.rename(self.old_fn_fq, self.new_fn_fq)
+            # The old name is deliberately left in existing_fns. On a case
+            # sensitive filesystem another file may share its folded name.
+            if self.existing_fns is not None:
+                self.existing_fns.add(self.new_fn.casefold())
             self._chmod()
         except OSError as e:
-            print("Unable to rename file: {0}".format(e.strerror),
-                    file=sys.stderr)
+            print(f"Unable to rename file: {e.strerror}", file=sys.stderr)
+
+    def _is_same_file(self, fn):
+        """Return True if fn, which differs from old_fn at most in case, names
+        old_fn itself rather than another file in workdir."""
+        if fn == self.old_fn:
+            return True
+        fn_fq = self.workdir_prefix + fn
+        return (not os.path.exists(fn_fq) or
+                os.path.samefile(self.old_fn_fq, fn_fq))
 
     def make_new_fn_unique(self):
         """Check new_fn for uniqueness in 'workdir'. Rename, adding a numerical
         suffix until it is unique.
         """
 
-        # Rename file by appending number if we have collision.
-        # TODO: I wish I didn't specify \d+_\d+ for the first part. perhaps not
-        # -\d\ before .jpg would be better for the second
-        # match.
+        # Check the in-memory directory listing rather than stat() each
+        # candidate filename. Without a shared listing, list the directory
+        # now. The directory mtime cannot tell whether a cached listing is
+        # stale, since it may not change across a rename (FAT, timer ticks).
+        # Names are compared case-folded, as a case insensitive filesystem
+        # (macOS, Windows) would compare them.
+        if self.existing_fns is None:
+            self.existing_fns = list_existing_fns(self.workdir)
+
+        # Rename file by appending number if we have collision. Only names in
+        # the YYYYMMDD_HHMMSS.jpg form get a numerical suffix.
+        match = _NUMBERED_FN_RE.match(self.new_fn)
         new_fn = self.new_fn
         counter = 1
-        while(os.path.exists(self.new_fn_fq)):
-            if (self.old_fn == self.new_fn):
+        while new_fn.casefold() in self.existing_fns:
+            if (self.old_fn.casefold() == new_fn.casefold() and
+                    self._is_same_file(new_fn)):
                 # Same file, faux collision.
                 break
             if (not self.avoid_collisions):
                 # Do not attempt to rename.
                 self.collision_detected = True
                 break
-            new_fn = re.sub(r'^(\d+_\d+)-\d+\.jpg',
-                    r'\1-{0}.jpg'.format(counter), self.new_fn)
-            new_fn = re.sub(r'^(\d+_\d+)\.jpg',
-                    r'\1-{0}.jpg'.format(counter), self.new_fn)
+            if match is not None:
+                new_fn = f"{match.group(1)}-{counter}.jpg"
             counter += 1
             if counter > self.MAX_RENAME_ATTEMPTS:
-                raise Exception("Too many rename attempts: {0}".format(self.new_fn))
-            self.new_fn_fq = os.path.join(self.workdir, new_fn)
+                raise Exception(f"Too many rename attempts: {self.new_fn}")
         self.new_fn = new_fn
-        self.new_fn_fq = os.path.join(self.workdir, new_fn)
+        self.new_fn_fq = self.workdir_prefix + new_fn
 
 
 class FileMapList():
@@ -218,13 +377,31 @@ class FileMapList():
         return (x for x in self.file_map)
 
 
-def init_file_map(workdir, avoid_collisions=None):
+def list_existing_fns(workdir):
+    """Return the set of case-folded filenames in workdir used for collision
+    checks."""
+    return set(fn.casefold() for fn in os.listdir(workdir or os.curdir))
+
+
+def _init_one(filename, avoid_collisions, existing_fns):
+    """Create the FileMap instance for a single file. Errors are reported and
+    None is returned so that one bad file does not stop the others."""
+    try:
+        return FileMap(filename, avoid_collisions,
+                existing_fns=existing_fns)
+    except Exception as e:
+        print(e, file=sys.stderr)
+        return None
+
+
+def init_file_map(workdir, avoid_collisions=None, jobs=None):
     """Read the work directory looking for files with extensions defined in the
     EXTENSIONS constant. Note that this could use a more elaborate magic
     number mechanism that would be cool.
 
     Arguments:
         str: workdir - The directory in which all activity will occur.
+        int: jobs - Number of threads reading EXIF data. Serial if None.
 
     Returns:
         list: file_map - List of FileMap instances.
@@ -233,19 +410,85 @@ def init_file_map(workdir, avoid_collisions=None):
     # List of FileMap objects.
     file_map = FileMapList()
 
+    # Read the directory once. Every name goes into the listing shared by all
+    # FileMap instances for collision checks.
+    with os.scandir(workdir) as it:
+        entries = list(it)
+    existing_fns = set(entry.name.casefold() for entry in entries)
+    filenames = [entry.path for entry in entries
+                 if _is_jpeg_name(entry.name) and entry.is_file()]
+    collisions = [avoid_collisions] * len(filenames)
+    listings = [existing_fns] * len(filenames)
+
+    # Reading EXIF data is I/O bound, so threads help when asked for. The
+    # file_map list itself is only built here in the main thread.
+    if jobs is not None and jobs > 1:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            instances = list(executor.map(_init_one, filenames, collisions,
+                    listings))
+    else:
+        instances = map(_init_one, filenames, collisions, listings)
+
     # Initialize file_map list.
-    for extension in EXTENSIONS:
-        for filename in glob.glob(os.path.join(workdir,
-                '*.{0}'.format(extension))):
+    for instance in instances:
+        if instance is not None:
+            file_map.add(instance)
+
+    return file_map
+
+
+def move_concurrently(fm_list, jobs):
+    """Move the files of a list of FileMap objects using a thread pool.
+
+    New filenames are reserved one file at a time first, exactly as move()
+    would do it. The old filenames stay in the directory listing meanwhile,
+    so no file is renamed onto one that has not been moved away yet. Only
+    the renames themselves run concurrently.
+
+    That only holds if every FileMap reserves names in the same listing.
+    FileMaps without one are given a single fresh listing of their workdir.
+    If the FileMaps still do not share one listing, e.g. because they come
+    from different directories, the files are moved one at a time, each
+    checked against a fresh listing.
+
+    Arguments:
+        list: fm_list - FileMap instances to move.
+        int: jobs - Number of threads renaming files.
+    Returns:
+        None
+    """
+    listings = {}
+    for fm in fm_list:
+        if fm.existing_fns is None:
+            if fm.workdir not in listings:
+                listings[fm.workdir] = list_existing_fns(fm.workdir)
+            fm.existing_fns = listings[fm.workdir]
+
+    if len(set(id(fm.existing_fns) for fm in fm_list)) > 1:
+        for fm in fm_list:
             try:
-                file_map.add(FileMap(filename, avoid_collisions))
+                # Separate listings do not see each other's renames.
+                fm.existing_fns = None
+                fm.move()
             except Exception as e:
-                print("{0}".format(e.message), file=sys.stderr)
+                print(e, file=sys.stderr)
+                break
+        return
 
-    return file_map
+    reserved = []
+    for fm in fm_list:
+        try:
+            if fm.reserve():
+                reserved.append(fm)
+        except Exception as e:
+            print(e, file=sys.stderr)
+            break
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(FileMap.rename, reserved))
 
 
-def process_file_map(file_map, simon_sez=None, move_func=None):
+def process_file_map(file_map, simon_sez=None, move_func=None, jobs=None):
     """Iterate through the Python list of FileMap objects. Move the file if
     Simon sez.
 
@@ -254,6 +497,7 @@ def process_file_map(file_map, simon_sez=None, move_func=None):
         dict: file_map - old_fn to new_fn mapping.
         boolean: simon_sez - Dry run or real thing.
         func: move_func - Move function to use for testing or default.
+        int: jobs - Number of threads renaming files. Serial if None.
     Returns:
         None
 
@@ -269,7 +513,12 @@ def process_file_map(file_map, simon_sez=None, move_func=None):
     if simon_sez is None:
         simon_sez = False
 
-    fm_list = file_map.get()
+    fm_list = list(file_map.get())
+    if (simon_sez and move_func is None and jobs is not None and jobs > 1 and
+            len(fm_list) >= MIN_CONCURRENT_RENAMES):
+        move_concurrently(fm_list, jobs)
+        return
+
     for fm in fm_list:
         try:
             if simon_sez:
@@ -279,31 +528,32 @@ def process_file_map(file_map, simon_sez=None, move_func=None):
                     move_func(fm.old_fn, fm.new_fn)
             else:
                 if fm.old_fn != fm.new_fn:
-                    print("DRY RUN: {0} ==> {1}".format(fm.old_fn, fm.new_fn))
+                    print(f"DRY RUN: {fm.old_fn} ==> {fm.new_fn}")
                     fm.same_files = False   # For unit test only.
         except Exception as e:
-            print("{0}".format(e.message), file=sys.stderr)
+            print(e, file=sys.stderr)
             break
 
 
-def process_all_files(workdir=None, simon_sez=None, avoid_collisions=None):
+def process_all_files(workdir=None, simon_sez=None, avoid_collisions=None,
+        jobs=None):
     """Manage the entire process of gathering data and renaming files."""
 
     if workdir is None:
         workdir = os.path.dirname(os.path.abspath(__file__))
 
     if not os.path.exists(workdir):
-        print("Directory {0} does not exist. Exiting.",format(workdir),
+        print(f"Directory {workdir} does not exist. Exiting.",
                 file=sys.stderr)
         sys.exit(1)
 
     if not os.access(workdir, os.W_OK):
-        print("Directory {0} is not writable. Exiting.".format(workdir),
+        print(f"Directory {workdir} is not writable. Exiting.",
                 file=sys.stderr)
         sys.exit(1)
 
-    file_map = init_file_map(workdir, avoid_collisions)
-    process_file_map(file_map, simon_sez)
+    file_map = init_file_map(workdir, avoid_collisions, jobs)
+    process_file_map(file_map, simon_sez, jobs=jobs)
 
 
 def main():
@@ -315,9 +565,11 @@ def main():
             help="Rename until filenames do not collide. Danger!", action="store_true")
     parser.add_argument("-d", "--directory",
             help="Read files from this directory.")
+    parser.add_argument("-j", "--jobs", type=int,
+            help="Read EXIF data and rename files with this many threads.")
     myargs = parser.parse_args()
     process_all_files(workdir=myargs.directory, simon_sez=myargs.simon_sez,
-            avoid_collisions=myargs.avoid_collisions)
+            avoid_collisions=myargs.avoid_collisions, jobs=myargs.jobs)
 
 if __name__ == '__main__':  # pragma: no cover
     main()
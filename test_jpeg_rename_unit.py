@@ -1,10 +1,12 @@
 import os
+import struct
 import sys
 import pytest
-from mock import Mock, patch
+from unittest.mock import Mock, patch
 app_path = os.path.dirname(os.path.abspath(__file__))
 sys.path.insert(0, app_path + '/../')
 
+import jpeg_rename
 from jpeg_rename import *
 
 # Setup valid EXIF data with expected new filename
@@ -28,6 +30,55 @@ OLD_FN_JPEG = 'filename.jpeg'
 
 SKIP_TEST = False
 
+
+class DirEntryStub():
+    """Stub to be used in place of os.DirEntry."""
+
+    def __init__(self, name, is_file=True):
+        self.name = name
+        self.path = os.path.join('/foo/bar', name)
+        self._is_file = is_file
+
+    def is_file(self):
+        return self._is_file
+
+
+# Three JPEG files plus entries init_file_map() must skip.
+DIR_ENTRIES = [DirEntryStub(OLD_FN_JPG_LOWER), DirEntryStub(OLD_FN_JPG_UPPER),
+               DirEntryStub(OLD_FN_JPEG), DirEntryStub('filename.png'),
+               DirEntryStub('subdir.jpg', is_file=False),
+               DirEntryStub('.hidden.jpg'), DirEntryStub('._IMG_0001.JPG'),
+               DirEntryStub('jpg')]
+
+
+def make_jpeg_bytes(date_time_original, byte_order='<',
+        leading_segments=b''):
+    """Build a minimal JPEG/EXIF header holding only the DateTimeOriginal
+    tag. byte_order is '<' for an II or '>' for an MM TIFF header.
+    leading_segments are written between SOI and the EXIF APP1 segment.
+    Values of up to four bytes are stored inline in the IFD entry."""
+    value = date_time_original.encode('ascii') + b'\x00'
+    tiff = {'<': b'II*\x00', '>': b'MM\x00*'}[byte_order]
+    tiff += struct.pack(byte_order + 'I', 8)
+    # IFD0 at offset 8 points to the EXIF IFD at offset 26.
+    tiff += struct.pack(byte_order + 'HHHII', 1, 0x8769, 4, 1, 26)
+    tiff += struct.pack(byte_order + 'I', 0)
+    # EXIF IFD at offset 26 holds the value or points to it at offset 44.
+    tiff += struct.pack(byte_order + 'HHHI', 1, 0x9003, 2, len(value))
+    if len(value) <= 4:
+        tiff += value.ljust(4, b'\x00') + struct.pack(byte_order + 'I', 0)
+    else:
+        tiff += struct.pack(byte_order + 'II', 44, 0) + value
+    app1 = b'Exif\x00\x00' + tiff
+    return (b'\xff\xd8' + leading_segments + b'\xff\xe1' +
+            struct.pack('>H', len(app1) + 2) + app1 + b'\xff\xd9')
+
+
+def make_segment(marker, payload):
+    """Build a JPEG marker segment."""
+    return b'\xff' + marker + struct.pack('>H', len(payload) + 2) + payload
+
+
 class TestGetNewFn():
     """Tests for method get_new_fn() are in this class."""
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
@@ -37,6 +88,7 @@ class TestGetNewFn():
         (OLD_FN_JPG_LOWER, OLD_FN_JPG_LOWER, EXIF_DATA_NOT_VALID),
         (OLD_FN_JPG_LOWER, OLD_FN_JPG_LOWER, {},),
         (OLD_FN_JPEG, OLD_FN_JPG_LOWER, {},),
+        ('IMG 01:02.JPEG', 'img_0102.jpg', {},),
     ])
     def test_get_new_fn_parametrized_exif_data(self, old_fn, expected_new_fn,
             exif_data):
@@ -49,43 +101,127 @@ class TestGetNewFn():
 class TestGetExifData():
     """Tests for method get_exif_data() are in this class."""
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
-    @patch('jpeg_rename.TAGS')
     @patch.object(Image, 'open')
-    def test_get_exif_data(self, mock_img, mock_tags):
+    def test_get_exif_data(self, mock_img):
         """Tests read_exif_data() with valid EXIF data. Tests for normal
         operation. Verify expected EXIF data in instantiated object."""
         class TestImage():
             def _getexif(self):
-                return EXIF_DATA_VALID['exif_data']
-
-        def get(arg1, arg2):
-            return 'DateTimeOriginal'
+                return {0x0110: 'Model', 0x9003:
+                        EXIF_DATA_VALID['exif_data']['DateTimeOriginal']}
 
         old_fn = OLD_FN_JPG_LOWER
         mock_img.return_value = TestImage()
-        mock_tags.get = get
         filemap = FileMap(old_fn)
-        assert filemap.exif_data == EXIF_DATA_VALID['exif_data']
+        assert (filemap.exif_dt ==
+                EXIF_DATA_VALID['exif_data']['DateTimeOriginal'])
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
-    @patch('jpeg_rename.TAGS')
     @patch.object(Image, 'open')
-    def test_get_exif_data_info_none(self, mock_img, mock_tags):
+    def test_get_exif_data_info_none(self, mock_img):
         """Tests read_exif_data() with no EXIF data available. Tests for
         raised Exception. Verify expected exception message."""
         class TestImage():
             def _getexif(self):
                 return None
 
-        def get(arg1, arg2):
-            return 'DateTimeOriginal'
-
         old_fn = OLD_FN_JPG_LOWER
         mock_img.return_value = TestImage()
-        mock_tags.get = get
         with pytest.raises(Exception) as excinfo:
             filemap = FileMap(old_fn)
-        assert excinfo.value[0] == "{0} has no EXIF data.".format(old_fn)
+        assert str(excinfo.value) == "{0} has no EXIF data.".format(old_fn)
+
+
+class TestReadExifDatetime():
+    """Tests for function _read_exif_datetime() are in this class."""
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_read_exif_datetime(self, tmpdir):
+        """Read DateTimeOriginal from APP1 segment. Verify expected value."""
+        exif_dt = EXIF_DATA_VALID['exif_data']['DateTimeOriginal']
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(make_jpeg_bytes(exif_dt), mode='wb')
+        assert jpeg_rename._read_exif_datetime(str(jpeg)) == exif_dt
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_read_exif_datetime_big_endian(self, tmpdir):
+        """Read DateTimeOriginal from an MM (big endian) TIFF header. Verify
+        expected value."""
+        exif_dt = EXIF_DATA_VALID['exif_data']['DateTimeOriginal']
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(make_jpeg_bytes(exif_dt, byte_order='>'), mode='wb')
+        assert jpeg_rename._read_exif_datetime(str(jpeg)) == exif_dt
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    @pytest.mark.parametrize("byte_order", ['<', '>'])
+    def test_read_exif_datetime_inline_value(self, tmpdir, byte_order):
+        """Read a DateTimeOriginal short enough to be stored in the IFD entry
+        itself. Verify expected value."""
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(make_jpeg_bytes('201', byte_order=byte_order), mode='wb')
+        assert jpeg_rename._read_exif_datetime(str(jpeg)) == '201'
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_read_exif_datetime_after_other_segments(self, tmpdir):
+        """Read DateTimeOriginal from an APP1 segment that follows a JFIF
+        APP0 segment and an XMP APP1 segment. Verify expected value."""
+        exif_dt = EXIF_DATA_VALID['exif_data']['DateTimeOriginal']
+        leading_segments = (
+            make_segment(b'\xe0',
+                         b'JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00') +
+            make_segment(b'\xe1', b'http://ns.adobe.com/xap/1.0/\x00<x/>'))
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(make_jpeg_bytes(exif_dt, leading_segments=leading_segments),
+                mode='wb')
+        assert jpeg_rename._read_exif_datetime(str(jpeg)) == exif_dt
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_read_exif_datetime_no_exif(self, tmpdir):
+        """Read file without APP1 segment. Verify None returned."""
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(b'\xff\xd8\xff\xd9', mode='wb')
+        assert jpeg_rename._read_exif_datetime(str(jpeg)) is None
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_read_exif_datetime_truncated_header(self, tmpdir):
+        """Read file cut off inside a segment header. Verify None returned."""
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(b'\xff\xd8\xff', mode='wb')
+        assert jpeg_rename._read_exif_datetime(str(jpeg)) is None
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    @patch.object(Image, 'open')
+    def test_read_exif_data_truncated_header_uses_pil(self, mock_img, tmpdir):
+        """Create FileMap from file cut off inside a segment header. Verify
+        PIL is used instead."""
+        class TestImage():
+            def _getexif(self):
+                return {0x9003:
+                        EXIF_DATA_VALID['exif_data']['DateTimeOriginal']}
+
+        mock_img.return_value = TestImage()
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(b'\xff\xd8\xff', mode='wb')
+        filemap = FileMap(str(jpeg))
+        assert filemap.new_fn == EXIF_DATA_VALID['expected_new_fn']
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_read_exif_datetime_empty_file(self, tmpdir):
+        """Read empty file, which cannot be memory mapped. Verify None
+        returned."""
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(b'', mode='wb')
+        assert jpeg_rename._read_exif_datetime(str(jpeg)) is None
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    @patch.object(Image, 'open')
+    def test_read_exif_data_skips_pil(self, mock_img, tmpdir):
+        """Create FileMap from file with APP1 segment. Verify PIL not used."""
+        jpeg = tmpdir.join(OLD_FN_JPG_LOWER)
+        jpeg.write(make_jpeg_bytes(
+            EXIF_DATA_VALID['exif_data']['DateTimeOriginal']), mode='wb')
+        filemap = FileMap(str(jpeg))
+        assert filemap.new_fn == EXIF_DATA_VALID['expected_new_fn']
+        assert not mock_img.called
 
 
 class TestMove():
@@ -103,6 +239,21 @@ class TestMove():
         filemap.move()
         mock_os.assert_called_with(old_fn, new_fn)
 
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    @patch('jpeg_rename.FileMap._chmod')
+    @patch('jpeg_rename.os.rename')
+    def test_move_updates_existing_fns(self, mock_os, mock_chmod):
+        """Rename file with mocked os.rename. Verify directory listing is
+        updated with the case-folded new filename."""
+        old_fn = OLD_FN_JPG_UPPER
+        existing_fns = set([old_fn.casefold()])
+        filemap = FileMap(old_fn, avoid_collisions=None,
+                exif_data=EXIF_DATA_VALID['exif_data'],
+                existing_fns=existing_fns)
+        filemap.move()
+        assert existing_fns == set([OLD_FN_JPG_LOWER,
+                                    EXIF_DATA_VALID['expected_new_fn']])
+
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
     @patch('jpeg_rename.FileMap.make_new_fn_unique')
     @patch('jpeg_rename.os.rename')
@@ -150,28 +301,28 @@ class TestMove():
 
 
 class TestRename():
-    """Tests for method get_new_fn() are in this class."""
+    """Tests for method make_new_fn_unique() are in this class."""
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
-    @patch('jpeg_rename.os.path.exists')
-    def test_rename_empty_exif_data(self, mock_exists):
+    def test_rename_empty_exif_data(self):
         """Make unique filename with empty EXIF data."""
-        mock_exists.return_value = True
         old_fn = OLD_FN_JPG_LOWER
         exif_data = EXIF_DATA_NOT_VALID
-        filemap = FileMap(old_fn, avoid_collisions=True, exif_data=exif_data)
+        filemap = FileMap(old_fn, avoid_collisions=True, exif_data=exif_data,
+                existing_fns=set([old_fn]))
         new_fn = filemap.new_fn
         filemap.make_new_fn_unique()
         assert filemap.new_fn == old_fn
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
-    @patch('jpeg_rename.os.path.exists')
-    def test_rename_with_valid_exif_data_and_avoid_collisions(self,
-            mock_exists):
+    def test_rename_with_valid_exif_data_and_avoid_collisions(self):
         """Make unique new filename from valid EXIF data. Avoid collisions."""
-        mock_exists.return_value = True
         old_fn = OLD_FN_JPG_LOWER
         exif_data = EXIF_DATA_VALID['exif_data']
-        filemap = FileMap(old_fn, avoid_collisions=True, exif_data=exif_data)
+        expected_new_fn = EXIF_DATA_VALID['expected_new_fn']
+        existing_fns = set([expected_new_fn,
+                            expected_new_fn.replace('.jpg', '-1.jpg')])
+        filemap = FileMap(old_fn, avoid_collisions=True, exif_data=exif_data,
+                existing_fns=existing_fns)
         new_fn = filemap.new_fn
         filemap.MAX_RENAME_ATTEMPTS = 2
         with pytest.raises(Exception):
@@ -179,45 +330,111 @@ class TestRename():
         assert filemap.new_fn == EXIF_DATA_VALID['expected_new_fn']
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
-    @patch('jpeg_rename.os.path.exists')
-    def test_rename_with_valid_exif_data_and_no_avoid_collisions(self,
-            mock_exists):
+    def test_rename_with_valid_exif_data_and_avoid_collisions_suffix(self):
+        """Make unique new filename from valid EXIF data. Avoid collisions.
+        Verify numerical suffix is added to new filename."""
+        old_fn = OLD_FN_JPG_LOWER
+        exif_data = EXIF_DATA_VALID['exif_data']
+        expected_new_fn = EXIF_DATA_VALID['expected_new_fn']
+        existing_fns = set([expected_new_fn,
+                            expected_new_fn.replace('.jpg', '-1.jpg')])
+        filemap = FileMap(old_fn, avoid_collisions=True, exif_data=exif_data,
+                existing_fns=existing_fns)
+        filemap.make_new_fn_unique()
+        assert filemap.new_fn == expected_new_fn.replace('.jpg', '-2.jpg')
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_rename_with_valid_exif_data_and_no_avoid_collisions(self):
         """Make unique new filename from valid EXIF data. Do not avoid
         collisions."""
-        mock_exists.return_value = True
         old_fn = OLD_FN_JPG_LOWER
         exif_data = EXIF_DATA_VALID['exif_data']
-        filemap = FileMap(old_fn, avoid_collisions=False, exif_data=exif_data)
+        filemap = FileMap(old_fn, avoid_collisions=False, exif_data=exif_data,
+                existing_fns=set([EXIF_DATA_VALID['expected_new_fn']]))
         new_fn = filemap.new_fn
         filemap.MAX_RENAME_ATTEMPTS = 2
         filemap.make_new_fn_unique()
         assert filemap.new_fn == EXIF_DATA_VALID['expected_new_fn']
+        assert filemap.collision_detected == True
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
-    @patch('jpeg_rename.os.path.exists')
-    def test_rename_no_collision(self, mock_exists):
+    def test_rename_case_variant_collision(self):
+        """Make unique new filename when another file's name differs from it
+        only in case. Verify collision is detected."""
+        filemap = FileMap('IMG_0001.JPEG', avoid_collisions=False,
+                exif_data={},
+                existing_fns=set(['img_0001.jpeg', 'img_0001.jpg']))
+        filemap.make_new_fn_unique()
+        assert filemap.new_fn == 'img_0001.jpg'
+        assert filemap.collision_detected == True
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_move_case_variants(self, tmpdir):
+        """Move IMG_0001.JPG and IMG_0001.JPEG, which both map to
+        img_0001.jpg. Verify neither file is overwritten."""
+        for old_fn in ('IMG_0001.JPG', 'IMG_0001.JPEG'):
+            tmpdir.join(old_fn).write(old_fn)
+            FileMap(str(tmpdir.join(old_fn)), avoid_collisions=False,
+                    exif_data={}).move()
+        assert tmpdir.join('img_0001.jpg').read() == 'IMG_0001.JPG'
+        assert tmpdir.join('IMG_0001.JPEG').read() == 'IMG_0001.JPEG'
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_move_case_only_distinct_file(self, tmpdir):
+        """Move A.JPG while a distinct a.jpg exists, as on a case sensitive
+        filesystem. Verify a.jpg is not overwritten."""
+        tmpdir.join('a.jpg').write('a.jpg')
+        tmpdir.join('A.JPG').write('A.JPG')
+        if len(os.listdir(str(tmpdir))) != 2:
+            pytest.skip("Case insensitive filesystem.")
+        filemap = FileMap(str(tmpdir.join('A.JPG')), avoid_collisions=False,
+                exif_data={})
+        filemap.move()
+        assert filemap.collision_detected == True
+        assert tmpdir.join('a.jpg').read() == 'a.jpg'
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    @patch('jpeg_rename.os.listdir')
+    def test_rename_no_collision(self, mock_listdir):
         """Make unique new filename from valid EXIF data. Do not avoid
-        collisions."""
-        mock_exists.return_value = False
+        collisions. Verify directory is listed when no listing was given."""
+        mock_listdir.return_value = []
         old_fn = OLD_FN_JPG_LOWER
         exif_data = {}
         filemap = FileMap(old_fn, avoid_collisions=False, exif_data=exif_data)
         new_fn = filemap.new_fn
         filemap.make_new_fn_unique()
         assert filemap.new_fn == old_fn
+        mock_listdir.assert_called_with(os.curdir)
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_move_without_existing_fns_unchanged_mtime(self, tmpdir):
+        """Move two files with the same EXIF date, each FileMap created
+        without a shared listing, while the directory mtime stays the same.
+        Verify the second file does not overwrite the first."""
+        exif_dt = EXIF_DATA_VALID['exif_data']['DateTimeOriginal']
+        expected_new_fn = EXIF_DATA_VALID['expected_new_fn']
+        for old_fn in ('A.JPG', 'B.JPG'):
+            tmpdir.join(old_fn).write(make_jpeg_bytes(exif_dt), mode='wb')
+        st = os.stat(str(tmpdir))
+        FileMap(str(tmpdir.join('A.JPG')), True).move()
+        os.utime(str(tmpdir), ns=(st.st_atime_ns, st.st_mtime_ns))
+        FileMap(str(tmpdir.join('B.JPG')), True).move()
+        assert set(os.listdir(str(tmpdir))) == set(
+            [expected_new_fn, expected_new_fn.replace('.jpg', '-1.jpg')])
 
 
 class TestInitFileMap():
     """Tests for function init_file_map() are in this class."""
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
     @patch('jpeg_rename.FileMap')
-    @patch('jpeg_rename.glob')
-    def test_init_file_map_orthodox(self, mock_glob, mock_filemap):
+    @patch('jpeg_rename.os.scandir')
+    def test_init_file_map_orthodox(self, mock_scandir, mock_filemap):
         """Tests init_file_map() list building. Verifies expected return value.
         """
         test_file_map = TestFileMap()
         mock_filemap.return_value = test_file_map
-        mock_glob.glob.return_value = ['/foo/bar']
+        mock_scandir.return_value.__enter__.return_value = DIR_ENTRIES
         file_map = init_file_map('.')
         assert file_map.file_map == [test_file_map,
                                      test_file_map,
@@ -225,12 +442,26 @@ class TestInitFileMap():
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
     @patch('jpeg_rename.FileMap')
-    @patch('jpeg_rename.glob')
-    def test_init_file_map_raises_exception(self, mock_glob, mock_filemap):
+    @patch('jpeg_rename.os.scandir')
+    def test_init_file_map_jobs(self, mock_scandir, mock_filemap):
+        """Tests init_file_map() list building with a thread pool. Verifies
+        expected return value."""
+        test_file_map = TestFileMap()
+        mock_filemap.return_value = test_file_map
+        mock_scandir.return_value.__enter__.return_value = DIR_ENTRIES
+        file_map = init_file_map('.', jobs=2)
+        assert file_map.file_map == [test_file_map,
+                                     test_file_map,
+                                     test_file_map]
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    @patch('jpeg_rename.FileMap')
+    @patch('jpeg_rename.os.scandir')
+    def test_init_file_map_raises_exception(self, mock_scandir, mock_filemap):
         """Tests init_file_map() with exception handling. Test exception raised
         when append to file_map list. Verify expected file_map returned."""
         mock_filemap.side_effect = Exception("Just testing.")
-        mock_glob.glob.return_value = ['/foo/bar']
+        mock_scandir.return_value.__enter__.return_value = DIR_ENTRIES
         file_map = init_file_map('.')
         assert file_map.file_map == []
 
@@ -294,6 +525,71 @@ class TestProcessFileMap():
         process_file_map(file_map_list, simon_sez=True)
         mock_fm.move.assert_called_with()
 
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    @patch('jpeg_rename.move_concurrently')
+    def test_process_file_map_jobs(self, mock_move_concurrently):
+        """Call process_file_map with simon_sez=True and jobs=2. Verify
+        move_concurrently() is called once there are enough files."""
+        file_map_list = FileMapList()
+        for index in range(MIN_CONCURRENT_RENAMES):
+            file_map_list.add(TestFileMap())
+        process_file_map(file_map_list, simon_sez=True, jobs=2)
+        mock_move_concurrently.assert_called_with(file_map_list.file_map, 2)
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_move_concurrently(self, tmpdir):
+        """Rename a directory of files using a thread pool, avoiding
+        collisions. Verify expected filenames in the directory."""
+        expected = set()
+        for index in range(MIN_CONCURRENT_RENAMES):
+            exif_dt = '2014:08:26 06:20:{0:02d}'.format(index)
+            tmpdir.join('IMG_{0:04d}.JPG'.format(index)).write(
+                make_jpeg_bytes(exif_dt), mode='wb')
+            expected.add('20140826_0620{0:02d}.jpg'.format(index))
+        tmpdir.join('IMG_9999.JPG').write(
+            make_jpeg_bytes('2014:08:26 06:20:00'), mode='wb')
+        expected.add('20140826_062000-1.jpg')
+        file_map = init_file_map(str(tmpdir), avoid_collisions=True)
+        process_file_map(file_map, simon_sez=True, jobs=4)
+        assert set(os.listdir(str(tmpdir))) == expected
+
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_move_concurrently_without_existing_fns(self, tmpdir):
+        """Rename files with the same EXIF date using a thread pool, each
+        FileMap created without a shared listing. Verify no file is
+        overwritten."""
+        exif_dt = EXIF_DATA_VALID['exif_data']['DateTimeOriginal']
+        expected_new_fn = EXIF_DATA_VALID['expected_new_fn']
+        file_map_list = FileMapList()
+        expected = set([expected_new_fn])
+        for index in range(MIN_CONCURRENT_RENAMES):
+            jpeg = tmpdir.join('IMG_{0:04d}.JPG'.format(index))
+            jpeg.write(make_jpeg_bytes(exif_dt), mode='wb')
+            file_map_list.add(FileMap(str(jpeg), True))
+            if index:
+                expected.add(expected_new_fn.replace(
+                    '.jpg', '-{0}.jpg'.format(index)))
+        process_file_map(file_map_list, simon_sez=True, jobs=4)
+        assert set(os.listdir(str(tmpdir))) == expected
+
+    @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
+    def test_move_concurrently_separate_listings(self, tmpdir):
+        """Rename files whose FileMaps hold separate listings of the same
+        directory. Verify the files are moved one at a time without any
+        being overwritten."""
+        exif_dt = EXIF_DATA_VALID['exif_data']['DateTimeOriginal']
+        expected_new_fn = EXIF_DATA_VALID['expected_new_fn']
+        file_map_list = FileMapList()
+        for old_fn in ('A.JPG', 'B.JPG'):
+            jpeg = tmpdir.join(old_fn)
+            jpeg.write(make_jpeg_bytes(exif_dt), mode='wb')
+            file_map_list.add(FileMap(str(jpeg), True,
+                    existing_fns=list_existing_fns(str(tmpdir))))
+        move_concurrently(list(file_map_list.get()), 2)
+        assert set(os.listdir(str(tmpdir))) == set(
+            [expected_new_fn, expected_new_fn.replace('.jpg', '-1.jpg')])
+
 
 class TestProcessAllFiles():
     """Tests for the function process_all_files() are in this class."""
@@ -312,7 +608,7 @@ class TestProcessAllFiles():
         mock_exists.return_value = True
         mock_dirname.return_value = DIRNAME
         process_all_files()
-        mock_init_file_map.assert_called_with(DIRNAME, None)
+        mock_init_file_map.assert_called_with(DIRNAME, None, None)
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
     @patch('jpeg_rename.process_file_map')
@@ -327,7 +623,7 @@ class TestProcessAllFiles():
         mock_init_file_map.return_value = file_map
         mock_os_access.return_value = True
         process_all_files('.')
-        mock_process_file_map.assert_called_with(file_map, None)
+        mock_process_file_map.assert_called_with(file_map, None, jobs=None)
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
     @patch('jpeg_rename.process_file_map')
@@ -342,7 +638,7 @@ class TestProcessAllFiles():
         mock_init_file_map.return_value = file_map
         mock_os_path.return_value = True
         process_all_files('.')
-        mock_process_file_map.assert_called_with(file_map, None)
+        mock_process_file_map.assert_called_with(file_map, None, jobs=None)
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
     @patch('jpeg_rename.os.path.exists')
@@ -368,7 +664,7 @@ class TestProcessAllFiles():
         mock_init_file_map.return_value = file_map
         mock_os_access.return_value = True
         process_all_files('.')
-        mock_process_file_map.assert_called_with(file_map, None)
+        mock_process_file_map.assert_called_with(file_map, None, jobs=None)
 
     @pytest.mark.skipif(SKIP_TEST, reason="Work in progress")
     @patch('jpeg_rename.os.access')
@@ -425,6 +721,7 @@ class TestMainFunction():
                 directory = '.'
                 simon_sez = False
                 avoid_collisions = False
+                jobs = None
 
             return Args()
 
@@ -437,7 +734,7 @@ class TestMainFunction():
         mock_process_all_files.return_value = 1234
         retval = main()
         mock_process_all_files.assert_called_with(workdir='.', simon_sez=False,
-                avoid_collisions=False)
+                avoid_collisions=False, jobs=None)
 
 
 class TestFileMap():